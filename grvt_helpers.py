@@ -7,10 +7,15 @@ GRVT Helper Functions
 
 import os
 import sys
+import math
+import operator
+import time
 import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from typing import Dict, Any, Optional, List
-from decimal import Decimal, ROUND_HALF_UP
-from datetime import datetime
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 from eth_account import Account
@@ -29,6 +34,21 @@ except ImportError:
     print("   2. ติดตั้ง pysdk: pip install git+https://github.com/gravity-technologies/grvt-pysdk.git")
     print("   3. เลือก Jupyter kernel ที่ถูกต้อง (.\env\Scripts\python.exe)")
 
+# Optional: coincurve สำหรับ sign secp256k1 โดยตรง (เร็วกว่าผ่าน eth_account)
+try:
+    import coincurve
+    from eth_utils import keccak
+    COINCURVE_AVAILABLE = True
+except ImportError:
+    COINCURVE_AVAILABLE = False
+
+# Optional: numba สำหรับ validate TP/SL แบบ vectorized (backtest / parameter sweep)
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 
 
 # ============================================================================
@@ -60,6 +80,13 @@ def load_grvt_config(env_file: str = '.env') -> Dict[str, str]:
     return config
 
 
+_REQUIRED_CONFIG_FIELDS = frozenset((
+    'GRVT_API_KEY',
+    'GRVT_PRIVATE_KEY',
+    'GRVT_TRADING_ACCOUNT_ID',
+))
+
+
 def validate_config(config: Dict[str, str]) -> tuple[bool, List[str]]:
     """
     ตรวจสอบว่า configuration ครบถ้วนหรือไม่
@@ -70,16 +97,8 @@ def validate_config(config: Dict[str, str]) -> tuple[bool, List[str]]:
     Returns:
         (is_valid, missing_fields)
     """
-    required_fields = [
-        'GRVT_API_KEY',
-        'GRVT_PRIVATE_KEY',
-        'GRVT_TRADING_ACCOUNT_ID',
-    ]
-    
-    missing = []
-    for field in required_fields:
-        if not config.get(field) or config[field] == '':
-            missing.append(field)
+    present = {field for field, value in config.items() if value}
+    missing = sorted(_REQUIRED_CONFIG_FIELDS - present)
     
     return (len(missing) == 0, missing)
 
@@ -127,6 +146,51 @@ def connect_to_grvt(config: Dict[str, str], logger: Optional[logging.Logger] = N
 # EIP-712 Signing
 # ============================================================================
 
+# EIP-712 types ของ GRVT Order (คงที่ ไม่ต้องสร้างใหม่ทุกครั้งที่ sign)
+_EIP712_TYPES = {
+    'EIP712Domain': [
+        {'name': 'name', 'type': 'string'},
+        {'name': 'version', 'type': 'string'},
+        {'name': 'chainId', 'type': 'uint256'},
+    ],
+    'Order': [
+        {'name': 'symbol', 'type': 'string'},
+        {'name': 'side', 'type': 'string'},
+        {'name': 'amount', 'type': 'uint256'},
+        {'name': 'price', 'type': 'uint256'},
+        {'name': 'nonce', 'type': 'uint256'},
+    ]
+}
+
+
+def _normalize_private_key(private_key: str) -> str:
+    """เติม 0x ข้างหน้า private key ถ้ายังไม่มี"""
+    if len(private_key) == 66 and private_key[1] == 'x':  # รูปแบบปกติ 0x + 64 hex
+        return private_key
+    return private_key if private_key.startswith('0x') else '0x' + private_key
+
+
+@lru_cache(maxsize=8)
+def _account_for(private_key: str):
+    """
+    สร้าง (และ cache) LocalAccount จาก private key
+    
+    Account.from_key ต้องคำนวณ public key ด้วย secp256k1 ทุกครั้ง
+    จึง cache ไว้เพื่อไม่ต้องคำนวณซ้ำเมื่อ sign หลาย orders ด้วย key เดิม
+    (cache ตาม key ที่ส่งเข้ามา จึงไม่ต้อง normalize ซ้ำเมื่อ cache hit)
+    
+    Args:
+        private_key: Private key (มีหรือไม่มี 0x ก็ได้)
+    """
+    return Account.from_key(_normalize_private_key(private_key))
+
+
+@lru_cache(maxsize=8)
+def _coincurve_key_for(key: bytes):
+    """สร้าง (และ cache) coincurve.PrivateKey จาก private key bytes"""
+    return coincurve.PrivateKey(bytes(key))
+
+
 def create_eip712_domain(chain_id: int = 1) -> Dict:
     """
     สร้าง EIP-712 Domain สำหรับ GRVT
@@ -144,6 +208,47 @@ def create_eip712_domain(chain_id: int = 1) -> Dict:
     }
 
 
+@lru_cache(maxsize=4)
+def _eip712_domain(chain_id: int) -> Dict:
+    """EIP-712 domain ต่อ chain_id (cached)"""
+    return create_eip712_domain(chain_id)
+
+
+def _sign_order(account, order_data: Dict) -> Dict[str, str]:
+    """ลงนาม order 1 รายการด้วย account ที่สร้างไว้แล้ว"""
+    # สร้าง typed data structure (types และ domain ใช้ซ้ำจาก cache)
+    typed_data = {
+        'types': _EIP712_TYPES,
+        'primaryType': 'Order',
+        'domain': _eip712_domain(order_data.get('chain_id', 1)),
+        'message': order_data
+    }
+    
+    # Encode และ Sign
+    encoded_data = encode_typed_data(full_message=typed_data)
+    
+    if COINCURVE_AVAILABLE:
+        # EIP-191 digest (เหมือนที่ eth_account คำนวณ) แล้ว sign ด้วย libsecp256k1 โดยตรง
+        digest = keccak(b'\x19' + encoded_data.version + encoded_data.header + encoded_data.body)
+        sig = _coincurve_key_for(account.key).sign_recoverable(digest, hasher=None)
+        r = int.from_bytes(sig[:32], 'big')
+        s = int.from_bytes(sig[32:64], 'big')
+        v = sig[64] + 27
+        signature_bytes = sig[:64] + bytes([v])
+    else:
+        signature = account.sign_message(encoded_data)
+        r, s, v = signature.r, signature.s, signature.v
+        signature_bytes = signature.signature
+    
+    return {
+        'r': hex(r),
+        's': hex(s),
+        'v': v,
+        'signature': signature_bytes.hex(),
+        'signer': account.address
+    }
+
+
 def sign_order_eip712(private_key: str, order_data: Dict) -> Dict[str, str]:
     """
     ลงนามคำสั่ง order ด้วย EIP-712
@@ -155,45 +260,28 @@ def sign_order_eip712(private_key: str, order_data: Dict) -> Dict[str, str]:
     Returns:
         Dictionary ที่มี signature components (r, s, v)
     """
-    # ตรวจสอบ private key format
-    if not private_key.startswith('0x'):
-        private_key = '0x' + private_key
+    # สร้าง account จาก private key (cached, เติม 0x ให้อัตโนมัติ)
+    account = _account_for(private_key)
+    
+    return _sign_order(account, order_data)
+
+
+def sign_orders_eip712(private_key: str, orders: List[Dict]) -> List[Dict[str, str]]:
+    """
+    ลงนามหลาย orders ด้วย EIP-712 (เช่น grid / market-making)
     
-    # สร้าง account จาก private key
-    account = Account.from_key(private_key)
+    สร้าง account ครั้งเดียวแล้วใช้ sign ทุก order
     
-    # สร้าง typed data structure
-    typed_data = {
-        'types': {
-            'EIP712Domain': [
-                {'name': 'name', 'type': 'string'},
-                {'name': 'version', 'type': 'string'},
-                {'name': 'chainId', 'type': 'uint256'},
-            ],
-            'Order': [
-                {'name': 'symbol', 'type': 'string'},
-                {'name': 'side', 'type': 'string'},
-                {'name': 'amount', 'type': 'uint256'},
-                {'name': 'price', 'type': 'uint256'},
-                {'name': 'nonce', 'type': 'uint256'},
-            ]
-        },
-        'primaryType': 'Order',
-        'domain': create_eip712_domain(order_data.get('chain_id', 1)),
-        'message': order_data
-    }
+    Args:
+        private_key: Private key (ต้องขึ้นต้นด้วย 0x)
+        orders: รายการข้อมูล order ที่ต้องการลงนาม
     
-    # Encode และ Sign
-    encoded_data = encode_typed_data(typed_data)
-    signature = account.sign_message(encoded_data)
+    Returns:
+        List ของ signature dictionaries (ลำดับเดียวกับ orders)
+    """
+    account = _account_for(private_key)
     
-    return {
-        'r': hex(signature.r),
-        's': hex(signature.s),
-        'v': signature.v,
-        'signature': signature.signature.hex(),
-        'signer': account.address
-    }
+    return [_sign_order(account, order_data) for order_data in orders]
 
 
 # ============================================================================
@@ -212,11 +300,12 @@ def format_currency(value, decimals: int = 2, symbol: str = '$') -> str:
     Returns:
         String ที่ format แล้ว เช่น "$1,234.56"
     """
-    # Convert to float if string
-    try:
-        value = float(value) if value is not None else 0.0
-    except (ValueError, TypeError):
-        value = 0.0
+    # Convert to float if string (ตัวเลขอยู่แล้วไม่ต้องแปลง)
+    if not isinstance(value, (int, float)):
+        try:
+            value = float(value) if value is not None else 0.0
+        except (ValueError, TypeError):
+            value = 0.0
     
     if value >= 0:
         return f"{symbol}{value:,.{decimals}f}"
@@ -235,16 +324,38 @@ def format_percentage(value, decimals: int = 2) -> str:
     Returns:
         String ที่ format แล้ว เช่น "+5.67%" หรือ "-2.34%"
     """
-    # Convert to float if string
-    try:
-        value = float(value) if value is not None else 0.0
-    except (ValueError, TypeError):
-        value = 0.0
+    # Convert to float if string (ตัวเลขอยู่แล้วไม่ต้องแปลง)
+    if not isinstance(value, (int, float)):
+        try:
+            value = float(value) if value is not None else 0.0
+        except (ValueError, TypeError):
+            value = 0.0
     
     sign = '+' if value >= 0 else ''
     return f"{sign}{value:.{decimals}f}%"
 
 
+# (ชื่อ metric, key path ใน fetch_balance())
+_ACCOUNT_METRICS = (
+    ('Total Equity', ('total', 'USDT')),
+    ('Available Balance', ('free', 'USDT')),
+    ('Used Margin', ('used', 'USDT')),
+    ('Unrealized P&L', ('info', 'unrealized_pnl')),
+)
+
+
+def _get_float(d, *path, default: float = 0.0) -> float:
+    """ดึงค่าตาม key path ใน nested dict แล้วแปลงเป็น float อย่างปลอดภัย"""
+    for key in path:
+        d = d.get(key) if isinstance(d, dict) else None
+        if d is None:
+            return default
+    try:
+        return float(d) if d != '' else default
+    except (ValueError, TypeError):
+        return default
+
+
 def create_account_table(account_data: Dict, positions: List[Dict] = None) -> pd.DataFrame:
     """
     สร้างตารางแสดงข้อมูล Account
@@ -256,28 +367,55 @@ def create_account_table(account_data: Dict, positions: List[Dict] = None) -> pd
     Returns:
         pandas DataFrame
     """
-    # Helper to safely get and convert to float
-    def safe_get_float(d, *keys, default=0.0):
-        val = d
-        for key in keys:
-            val = val.get(key, {}) if isinstance(val, dict) else default
-        try:
-            return float(val) if val not in (None, {}, '') else default
-        except (ValueError, TypeError):
-            return default
-    
     # Extract balance info
-    summary_data = {
-        'Metric': ['Total Equity', 'Available Balance', 'Used Margin', 'Unrealized P&L'],
-        'Value': [
-            format_currency(safe_get_float(account_data, 'total', 'USDT')),
-            format_currency(safe_get_float(account_data, 'free', 'USDT')),
-            format_currency(safe_get_float(account_data, 'used', 'USDT')),
-            format_currency(safe_get_float(account_data, 'info', 'unrealized_pnl'))
-        ]
-    }
+    summary_data = [
+        (metric, format_currency(_get_float(account_data, *path)))
+        for metric, path in _ACCOUNT_METRICS
+    ]
     
-    return pd.DataFrame(summary_data)
+    return pd.DataFrame.from_records(summary_data, columns=['Metric', 'Value'])
+
+
+_POSITION_NUMERIC_COLS = ['size', 'entry_price', 'mark_price', 'unrealized_pnl']
+
+
+def _positions_to_df(positions: List[Dict]) -> pd.DataFrame:
+    """
+    แปลง positions จาก fetch_positions() เป็น DataFrame ที่ normalize แล้ว
+    
+    รองรับทั้งโครงสร้างแบบ flat ('instrument', 'size', ...) และแบบมี 'legs'
+    (ใช้ 'instrument' และ 'size' จาก leg แรก)
+    
+    Args:
+        positions: รายการ positions จาก fetch_positions()
+    
+    Returns:
+        DataFrame ที่มี columns: instrument, size, entry_price, mark_price, unrealized_pnl
+        (เฉพาะ positions ที่ size != 0, ค่าตัวเลขเป็น float แล้ว)
+    """
+    df = pd.DataFrame(positions)
+    
+    if 'legs' in df:
+        # ค่าใน leg แรกมาก่อนค่าระดับ position
+        first_leg = pd.DataFrame(
+            [legs[0] if isinstance(legs, list) and legs else {} for legs in df['legs']],
+            index=df.index,
+        ).reindex(columns=['instrument', 'size'])
+        df = first_leg.combine_first(df)
+    
+    # GRVT uses 'instrument' และ 'size' แทน 'symbol' และ 'contracts'
+    instrument = df['instrument'] if 'instrument' in df else pd.Series(index=df.index, dtype=object)
+    if 'symbol' in df:
+        instrument = instrument.fillna(df['symbol'])
+    
+    df = df.reindex(columns=_POSITION_NUMERIC_COLS)
+    df = df.apply(pd.to_numeric, errors='coerce').fillna(0.0)
+    df.insert(0, 'instrument', instrument.fillna('N/A'))
+    
+    return df[df['size'] != 0]  # เฉพาะที่มี position
+
+
+_POSITIONS_TABLE_COLUMNS = ['Symbol', 'Side', 'Size', 'Entry Price', 'Mark Price', 'Unrealized P&L']
 
 
 def create_positions_table(positions: List[Dict]) -> pd.DataFrame:
@@ -291,35 +429,27 @@ def create_positions_table(positions: List[Dict]) -> pd.DataFrame:
         pandas DataFrame
     """
     if not positions:
-        return pd.DataFrame(columns=['Symbol', 'Side', 'Size', 'Entry Price', 'Mark Price', 'Unrealized P&L'])
-    
-    # Helper to safely convert to float
-    def safe_float(value, default=0.0):
-        try:
-            return float(value) if value not in (None, '', 'N/A') else default
-        except (ValueError, TypeError):
-            return default
-    
-    data = []
-    for pos in positions:
-        # GRVT uses 'size' instead of 'contracts'
-        size = safe_float(pos.get('size', 0))
-        if size != 0:  # แสดงเฉพาะที่มี position
-            data.append({
-                'Symbol': pos.get('instrument', 'N/A'),  # GRVT uses 'instrument'
-                'Side': 'LONG' if size > 0 else 'SHORT',
-                'Size': abs(size),
-                'Entry Price': format_currency(safe_float(pos.get('entry_price', 0))),
-                'Mark Price': format_currency(safe_float(pos.get('mark_price', 0))),
-                'Unrealized P&L': format_currency(safe_float(pos.get('unrealized_pnl', 0)))
-            })
-    
-    return pd.DataFrame(data)
+        return pd.DataFrame(columns=_POSITIONS_TABLE_COLUMNS)
+    
+    df = _positions_to_df(positions)
+    
+    return pd.DataFrame({
+        'Symbol': df['instrument'],
+        'Side': np.where(df['size'] > 0, 'LONG', 'SHORT'),
+        'Size': df['size'].abs(),
+        'Entry Price': df['entry_price'].map(format_currency),
+        'Mark Price': df['mark_price'].map(format_currency),
+        'Unrealized P&L': df['unrealized_pnl'].map(format_currency),
+    }, columns=_POSITIONS_TABLE_COLUMNS, copy=False).reset_index(drop=True)
+
+
+# 1 / tick_size ของ tick ที่ใช้บ่อย (คูณแทนหาร และได้ผลลัพธ์ float ที่ตรงกว่า)
+_TICK_INV = {0.5: 2.0, 0.1: 10.0, 1.0: 1.0, 0.01: 100.0}
 
 
 def round_to_tick_size(price: float, tick_size: float = 0.5) -> float:
     """
-    Round price ให้ตรงกับ tick size ของ GRVT
+    Round price ให้ตรงกับ tick size ของ GRVT (ปัดครึ่งขึ้น / round half up)
     
     Args:
         price: ราคาที่ต้องการ round
@@ -335,8 +465,24 @@ def round_to_tick_size(price: float, tick_size: float = 0.5) -> float:
         86486.5
         >>> round_to_tick_size(86486.17, 1.0)
         86486.0
+        >>> round_to_tick_size(86486.25, 0.5)
+        86486.5
     """
-    return round(price / tick_size) * tick_size
+    inv = _TICK_INV.get(tick_size)
+    if inv:
+        return math.floor(price * inv + 0.5) / inv
+    return math.floor(price / tick_size + 0.5) * tick_size
+
+
+# (is_long, 'TP'/'SL') -> (เงื่อนไขที่ถือว่าผิด, error message)
+_TPSL_RULES = {
+    # Long: TP ต้องสูงกว่า, SL ต้องต่ำกว่าราคาปัจจุบัน
+    (True, 'TP'): (operator.le, "TP for LONG must be > last price (${last_price:.2f})"),
+    (True, 'SL'): (operator.ge, "SL for LONG must be < last price (${last_price:.2f})"),
+    # Short: TP ต้องต่ำกว่า, SL ต้องสูงกว่าราคาปัจจุบัน
+    (False, 'TP'): (operator.ge, "TP for SHORT must be < last price (${last_price:.2f})"),
+    (False, 'SL'): (operator.le, "SL for SHORT must be > last price (${last_price:.2f})"),
+}
 
 
 def validate_tpsl_prices(
@@ -366,29 +512,89 @@ def validate_tpsl_prices(
     
     is_long = side.lower() == 'sell'  # Long position = sell to close
     
-    # Validate TP
-    if take_profit_price:
-        if is_long:
-            # Long: TP must be higher than current price
-            if take_profit_price <= last_price:
-                return False, f"TP for LONG must be > last price (${last_price:.2f})"
-        else:
-            # Short: TP must be lower than current price
-            if take_profit_price >= last_price:
-                return False, f"TP for SHORT must be < last price (${last_price:.2f})"
+    for kind, price in (('TP', take_profit_price), ('SL', stop_loss_price)):
+        if price:
+            is_invalid, message = _TPSL_RULES[(is_long, kind)]
+            if is_invalid(price, last_price):
+                return False, message.format(last_price=last_price)
     
-    # Validate SL
-    if stop_loss_price:
+    return True, ""
+
+
+if NUMBA_AVAILABLE:
+    @numba.njit(parallel=True, cache=True)
+    def _validate_tpsl_vec(is_long, last, tp, sl):
+        n = last.size
+        out = np.ones(n, dtype=np.bool_)
+        for i in numba.prange(n):
+            if is_long:
+                if (tp[i] != 0 and tp[i] <= last[i]) or (sl[i] != 0 and sl[i] >= last[i]):
+                    out[i] = False
+            else:
+                if (tp[i] != 0 and tp[i] >= last[i]) or (sl[i] != 0 and sl[i] <= last[i]):
+                    out[i] = False
+        return out
+else:
+    def _validate_tpsl_vec(is_long, last, tp, sl):
         if is_long:
-            # Long: SL must be lower than current price
-            if stop_loss_price >= last_price:
-                return False, f"SL for LONG must be < last price (${last_price:.2f})"
+            invalid = ((tp != 0) & (tp <= last)) | ((sl != 0) & (sl >= last))
         else:
-            # Short: SL must be higher than current price
-            if stop_loss_price <= last_price:
-                return False, f"SL for SHORT must be > last price (${last_price:.2f})"
+            invalid = ((tp != 0) & (tp >= last)) | ((sl != 0) & (sl <= last))
+        return ~invalid
+
+
+def validate_tpsl_prices_batch(
+    side: str,
+    last_price,
+    take_profit_prices=None,
+    stop_loss_prices=None
+) -> np.ndarray:
+    """
+    Validate TP/SL หลายชุดพร้อมกัน (สำหรับ backtest / parameter sweep)
     
-    return True, ""
+    ใช้กฎเดียวกับ validate_tpsl_prices() แต่รับ arrays และคืนค่าเป็น boolean mask
+    (compile ด้วย numba ถ้าติดตั้งไว้ ไม่งั้นใช้ NumPy)
+    
+    ค่า 0 (หรือ None) = ไม่ตั้ง TP/SL เหมือน scalar version, ค่าอื่นรวมถึงค่าติดลบ
+    ถูกตรวจตามกฎปกติ ส่วน NaN ไม่ทำให้ invalid เพราะเปรียบเทียบแล้วเป็น False เสมอ
+    
+    Args:
+        side: 'buy' or 'sell' - direction of the CLOSING order
+        last_price: ราคาปัจจุบัน (scalar หรือ array / pandas Series)
+        take_profit_prices: TP prices (array / Series, 0 = ไม่ตั้ง TP)
+        stop_loss_prices: SL prices (array / Series, 0 = ไม่ตั้ง SL)
+    
+    Returns:
+        numpy boolean array (True = valid)
+    
+    Examples:
+        >>> validate_tpsl_prices_batch('sell', 100.0, [110, 90, 0], [95, 95, 105])
+        array([ True, False, False])
+    """
+    is_long = side.lower() == 'sell'  # Long position = sell to close
+    
+    last, tp, sl = np.broadcast_arrays(
+        np.asarray(last_price, dtype=np.float64),
+        np.asarray(take_profit_prices if take_profit_prices is not None else 0.0, dtype=np.float64),
+        np.asarray(stop_loss_prices if stop_loss_prices is not None else 0.0, dtype=np.float64),
+    )
+    last, tp, sl = (np.ascontiguousarray(a).ravel() for a in (last, tp, sl))
+    
+    return _validate_tpsl_vec(is_long, last, tp, sl)
+
+
+def _tpsl_trigger(trigger_type: str, price: float, trigger_by: str, close_position: bool) -> dict:
+    """สร้าง trigger params ของ TP หรือ SL 1 รายการ"""
+    return {
+        'trigger': {
+            'trigger_type': trigger_type,
+            'tpsl': {
+                'trigger_price': str(price),
+                'trigger_by': trigger_by,
+                'close_position': close_position
+            }
+        }
+    }
 
 
 def create_tpsl_params(
@@ -432,29 +638,11 @@ def create_tpsl_params(
     
     # Create TP params
     if take_profit_price:
-        params['take_profit'] = {
-            'trigger': {
-                'trigger_type': 'TAKE_PROFIT',
-                'tpsl': {
-                    'trigger_price': str(take_profit_price),
-                    'trigger_by': trigger_by,
-                    'close_position': close_position
-                }
-            }
-        }
+        params['take_profit'] = _tpsl_trigger('TAKE_PROFIT', take_profit_price, trigger_by, close_position)
     
     # Create SL params
     if stop_loss_price:
-        params['stop_loss'] = {
-            'trigger': {
-                'trigger_type': 'STOP_LOSS',
-                'tpsl': {
-                    'trigger_price': str(stop_loss_price),
-                    'trigger_by': trigger_by,
-                    'close_position': close_position
-                }
-            }
-        }
+        params['stop_loss'] = _tpsl_trigger('STOP_LOSS', stop_loss_price, trigger_by, close_position)
     
     return params
 
@@ -464,6 +652,10 @@ def create_tpsl_params(
 # Emergency Functions
 # ============================================================================
 
+# จำนวน requests ที่ส่งพร้อมกันสูงสุดในฟังก์ชันฉุกเฉิน (GRVT: 200 orders / 10 วินาที)
+_MAX_PARALLEL_REQUESTS = 20
+
+
 def emergency_cancel_all(client: Any) -> int:
     """
     🚨 ยกเลิก Orders ทั้งหมด
@@ -544,6 +736,12 @@ class RateLimiter:
     """
     Rate Limiter สำหรับควบคุมความถี่ในการส่ง orders
     GRVT: 200 orders per 10 seconds
+    
+    ใช้ token bucket (ใช้ memory คงที่ ไม่ต้องเก็บ timestamps):
+    - ความจุ bucket = max_requests / 2 (burst สูงสุดครึ่งหนึ่งของ limit)
+    - เติมคืนด้วยอัตรา max_requests / (2 * time_window) ต่อวินาที
+    ทำให้ capacity + rate * time_window = max_requests จึงไม่มีช่วง time_window ใด
+    ที่ส่งเกิน max_requests requests
     """
     
     def __init__(self, max_requests: int = 200, time_window: int = 10):
@@ -554,34 +752,33 @@ class RateLimiter:
         """
         self.max_requests = max_requests
         self.time_window = time_window
-        self.requests = []
+        self.capacity = max_requests / 2
+        self.rate = max_requests / (2 * time_window)  # tokens ที่ได้คืนต่อวินาที
+        self.tokens = self.capacity
+        self.last = time.monotonic()
     
     def can_make_request(self) -> bool:
         """ตรวจสอบว่าสามารถส่ง request ได้หรือไม่"""
-        now = datetime.now()
+        now = time.monotonic()
         
-        # ลบ requests ที่เก่าเกินกว่า time window
-        self.requests = [
-            req_time for req_time in self.requests
-            if (now - req_time).total_seconds() < self.time_window
-        ]
+        # เติม tokens ตามเวลาที่ผ่านไป (ไม่เกิน capacity)
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
         
-        return len(self.requests) < self.max_requests
+        return self.tokens >= 1
     
     def record_request(self):
         """บันทึก request ใหม่"""
-        self.requests.append(datetime.now())
+        self.tokens -= 1
     
     def wait_if_needed(self):
         """รอถ้าเกิน rate limit"""
         if not self.can_make_request():
-            # คำนวณเวลาที่ต้องรอ
-            oldest_request = min(self.requests)
-            wait_time = self.time_window - (datetime.now() - oldest_request).total_seconds()
+            # คำนวณเวลาที่ต้องรอจนกว่าจะได้ 1 token
+            wait_time = (1 - self.tokens) / self.rate
             
             if wait_time > 0:
                 print(f"⏳ Rate limit exceeded. รอ {wait_time:.2f} วินาที...")
-                import time
                 time.sleep(wait_time + 0.1)  # เผื่อเวลาเล็กน้อย
 
 
@@ -618,11 +815,7 @@ def get_account_public_address(private_key: str) -> str:
     Returns:
         Public address (Ethereum format)
     """
-    if not private_key.startswith('0x'):
-        private_key = '0x' + private_key
-    
-    account = Account.from_key(private_key)
-    return account.address
+    return _account_for(private_key).address
 
 
 # ============================================================================
@@ -695,6 +888,7 @@ def emergency_cancel_all(client):
         
         print(f"📋 พบ {len(open_orders)} open order(s)")
         
+        order_ids = []
         for order in open_orders:
             try:
                 # ใช้ 'order_id' ตาม GRVT structure
@@ -717,25 +911,48 @@ def emergency_cancel_all(client):
                 emoji = "🟢" if side == "BUY" else "🔴"
                 
                 print(f"  ❌ Cancelling: {emoji} {symbol} - {side} (Order ID: {str(order_id)[:20]}...)")
-                
-                result = client.cancel_order(order_id)
-                
-                # เช็คว่าสำเร็จหรือไม่
-                if result is False or result is None or (isinstance(result, dict) and not result):
-                    print(f"     ⚠️ Failed to cancel")
-                else:
-                    count += 1
-                    print(f"     ✅ Cancelled")
-                    
+                order_ids.append(order_id)
             except Exception as e:
                 print(f"  ⚠️ Error cancelling order: {e}")
                 continue
         
+        if not order_ids:
+            return 0
+        
+        # ยกเลิกทั้งหมดด้วย request เดียว (ถ้า client รองรับ)
+        if hasattr(client, 'cancel_all_orders'):
+            try:
+                if client.cancel_all_orders():
+                    print(f"     ✅ Cancelled {len(order_ids)} order(s)")
+                    return len(order_ids)
+                print(f"     ⚠️ cancel_all_orders failed, ยกเลิกทีละ order แทน")
+            except Exception as e:
+                print(f"  ⚠️ Error in cancel_all_orders: {e}, ยกเลิกทีละ order แทน")
+        
+        # Fallback: ยกเลิกทีละ order แบบขนาน (จำกัด concurrency ไม่ให้เกิน rate limit)
+        def cancel_one(order_id):
+            try:
+                return client.cancel_order(order_id), None
+            except Exception as e:
+                return None, e
+        
+        with ThreadPoolExecutor(max_workers=_MAX_PARALLEL_REQUESTS) as executor:
+            results = list(executor.map(cancel_one, order_ids))
+        
+        for order_id, (result, error) in zip(order_ids, results):
+            if error is not None:
+                print(f"  ⚠️ Error cancelling order {str(order_id)[:20]}...: {error}")
+            # เช็คว่าสำเร็จหรือไม่
+            elif result is False or result is None or (isinstance(result, dict) and not result):
+                print(f"     ⚠️ Failed to cancel {str(order_id)[:20]}...")
+            else:
+                count += 1
+                print(f"     ✅ Cancelled {str(order_id)[:20]}...")
+        
         return count
         
     except Exception as e:
         print(f"❌ Error in emergency_cancel_all: {e}")
-        import traceback
         traceback.print_exc()
         return 0
 
@@ -754,30 +971,22 @@ def emergency_close_all(client):
         positions = client.fetch_positions()
         count = 0
         
-        # Filter non-zero positions
-        active_positions = [p for p in positions if safe_float(p.get('size', 0)) != 0]
+        # Normalize และ filter non-zero positions
+        active_positions = _positions_to_df(positions)
         
-        if not active_positions:
+        if active_positions.empty:
             print("ℹ️ ไม่มี open positions")
             return 0
         
         print(f"📊 พบ {len(active_positions)} open position(s)")
         
-        for pos in active_positions:
-            try:
-                # Parse GRVT position structure
-                legs = pos.get('legs', [])
-                if legs:
-                    leg = legs[0]
-                    symbol = leg.get('instrument', 'N/A')
-                    size = safe_float(leg.get('size', 0))
-                else:
-                    symbol = pos.get('symbol', pos.get('instrument', 'N/A'))
-                    size = safe_float(pos.get('size', 0))
-                
-                if size == 0:
-                    continue
-                
+        rate_limiter = RateLimiter()
+        futures = {}
+        
+        with ThreadPoolExecutor(max_workers=_MAX_PARALLEL_REQUESTS) as executor:
+            # ดึงเฉพาะ 2 columns ที่ใช้เป็น Python lists (ได้ float ธรรมดาส่งให้ SDK)
+            for symbol, size in zip(active_positions['instrument'].tolist(),
+                                    active_positions['size'].tolist()):
                 # กำหนด side ตรงข้าม
                 is_long = size > 0
                 side = 'sell' if is_long else 'buy'
@@ -788,8 +997,11 @@ def emergency_close_all(client):
                 
                 print(f"  🚪 Closing: {emoji} {symbol} - {position_type} ({amount:.4f})")
                 
-                # ส่ง market order เพื่อปิด position
-                order = client.create_order(
+                # ส่ง market order เพื่อปิด position (ส่งพร้อมกันหลาย positions ภายใต้ rate limit)
+                rate_limiter.wait_if_needed()
+                rate_limiter.record_request()
+                future = executor.submit(
+                    client.create_order,
                     symbol=symbol,
                     order_type='market',
                     side=side,
@@ -799,22 +1011,27 @@ def emergency_close_all(client):
                         'reduce_only': True  # ปิด position เท่านั้น
                     }
                 )
+                futures[future] = symbol
+            
+            # แสดงผลจาก main thread เท่านั้น เพื่อไม่ให้ output ปนกัน
+            for future in as_completed(futures):
+                symbol = futures[future]
+                try:
+                    order = future.result()
+                except Exception as e:
+                    print(f"  ⚠️ Error closing position {symbol}: {e}")
+                    continue
                 
                 if order is None or (isinstance(order, dict) and not order):
-                    print(f"     ⚠️ Failed to close")
+                    print(f"     ⚠️ Failed to close {symbol}")
                 else:
                     count += 1
-                    print(f"     ✅ Closed")
-                    
-            except Exception as e:
-                print(f"  ⚠️ Error closing position: {e}")
-                continue
+                    print(f"     ✅ Closed {symbol}")
         
         return count
         
     except Exception as e:
         print(f"❌ Error in emergency_close_all: {e}")
-        import traceback
         traceback.print_exc()
         return 0
 